@@ -0,0 +1,330 @@
+"""Hot/cold tiering and retention for the conversations table.
+
+Sessions idle for more than `archive_idle_days` are moved out of the
+`conversations` table into append-only gzip JSONL segments, one file per
+day of last activity (`conversations-YYYY-MM-DD.jsonl.gz`). Each session is
+written as its own gzip member and indexed in `archived_sessions` by byte
+offset, so reading it back only decompresses that session.
+
+Segments older than `archive_retention_days` are deleted together with
+their index rows. Clearing a session overwrites its members with zeros.
+Each batch lists its planned members in `pending.json` before writing them,
+so members left behind by a crash are zeroed on the next run.
+
+Usage:
+    python archive.py            # archive idle sessions, then expire old ones
+    python archive.py --dry-run  # only report what would be moved
+"""
+import argparse
+import gzip
+import json
+import os
+from datetime import date, datetime, time, timedelta
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal, DBArchivedSession, DBConversation, init_db
+
+SEGMENT_PREFIX = "conversations-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+DELETE_CHUNK_SIZE = 500
+JOURNAL_NAME = "pending.json"
+
+
+def segment_name(day: date) -> str:
+    """Return the segment file name holding sessions last active on `day`."""
+    return f"{SEGMENT_PREFIX}{day.isoformat()}{SEGMENT_SUFFIX}"
+
+
+def _segment_day(name: str) -> date:
+    return date.fromisoformat(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+def _serialize(conv: DBConversation) -> Dict:
+    return {
+        "id": conv.id,
+        "session_id": conv.session_id,
+        "user_id": conv.user_id,
+        "role": conv.role,
+        "content": conv.content,
+        "message_type": conv.message_type,
+        "image_url": conv.image_url,
+        "timestamp": conv.timestamp.isoformat() if conv.timestamp else None
+    }
+
+
+def _compress_session(rows: List[DBConversation]) -> bytes:
+    """Encode one session as a standalone gzip member."""
+    payload = "".join(json.dumps(_serialize(row), ensure_ascii=False) + "\n" for row in rows)
+    return gzip.compress(payload.encode("utf-8"))
+
+
+def _write_journal(spans: List[Tuple[str, int, int]]):
+    """Record the spans about to be appended, before any byte is written."""
+    with open(os.path.join(settings.archive_dir, JOURNAL_NAME), "w", encoding="utf-8") as f:
+        json.dump(spans, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _clear_journal():
+    try:
+        os.remove(os.path.join(settings.archive_dir, JOURNAL_NAME))
+    except FileNotFoundError:
+        pass
+
+
+def recover_interrupted_batch(db: Session):
+    """Zero the members of a batch that was written but never committed.
+
+    A crash between appending to a segment and committing the index leaves
+    text no index row points at, so clearing the session could not erase it.
+    """
+    path = os.path.join(settings.archive_dir, JOURNAL_NAME)
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        spans = [tuple(span) for span in json.load(f)]
+
+    orphaned = [
+        (segment, offset, length) for segment, offset, length in spans
+        if not db.query(DBArchivedSession.id).filter(
+            DBArchivedSession.segment == segment,
+            DBArchivedSession.offset == offset
+        ).first()
+    ]
+    scrub_archived_members(orphaned)
+    _clear_journal()
+
+
+def _append_members(segment: str, offset: int, members: List[bytes]):
+    """Append gzip members to a segment, which must end at `offset`."""
+    with open(os.path.join(settings.archive_dir, segment), "ab") as f:
+        if f.tell() != offset:
+            raise RuntimeError(f"{segment} changed while archiving; is another archive job running?")
+        for member in members:
+            f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def find_idle_sessions(
+    db: Session,
+    cutoff: datetime,
+    limit: Optional[int],
+    after: Optional[str] = None
+) -> List[Tuple[str, datetime]]:
+    """Return up to `limit` sessions, ordered by id and after `after`, idle since `cutoff`.
+
+    Paging on `session_id` lets each batch resume the index walk where the
+    previous one stopped instead of aggregating the whole table again.
+    """
+    last_message_at = func.max(DBConversation.timestamp)
+    query = db.query(DBConversation.session_id, last_message_at)
+    if after is not None:
+        query = query.filter(DBConversation.session_id > after)
+    return query.group_by(
+        DBConversation.session_id
+    ).having(last_message_at < cutoff).order_by(DBConversation.session_id).limit(limit).all()
+
+
+def archive_idle_sessions(db: Session, idle_days: int, batch_size: int) -> int:
+    """Move idle sessions to archive segments in batches. Returns sessions archived.
+
+    Only one archive job may run at a time: segment offsets are planned
+    before the bytes are appended.
+    """
+    os.makedirs(settings.archive_dir, exist_ok=True)
+    recover_interrupted_batch(db)
+    cutoff = datetime.now() - timedelta(days=idle_days)
+    archived = 0
+    last_seen = None
+
+    while True:
+        idle = find_idle_sessions(db, cutoff, batch_size, after=last_seen)
+        if not idle:
+            return archived
+
+        last_activity = dict(idle)
+        last_seen = idle[-1][0]
+        # Only rows older than the cutoff: a message arriving while the batch is
+        # archived stays in the hot table instead of being moved or deleted.
+        rows = db.query(DBConversation).filter(
+            DBConversation.session_id.in_(last_activity),
+            DBConversation.timestamp < cutoff
+        ).order_by(DBConversation.session_id, DBConversation.timestamp).all()
+
+        # Plan every member's span up front so the journal can name them all
+        planned = []  # (session_id, rows, segment, offset, length)
+        members: Dict[str, List[bytes]] = {}
+        segment_starts: Dict[str, int] = {}
+        segment_ends: Dict[str, int] = {}
+        for session_id, group in groupby(rows, key=lambda row: row.session_id):
+            session_rows = list(group)
+            segment = segment_name(last_activity[session_id].date())
+            if segment not in segment_ends:
+                path = os.path.join(settings.archive_dir, segment)
+                segment_starts[segment] = os.path.getsize(path) if os.path.exists(path) else 0
+                segment_ends[segment] = segment_starts[segment]
+            member = _compress_session(session_rows)
+            planned.append((session_id, session_rows, segment, segment_ends[segment], len(member)))
+            members.setdefault(segment, []).append(member)
+            segment_ends[segment] += len(member)
+
+        _write_journal([(segment, offset, length) for _, _, segment, offset, length in planned])
+        for segment, segment_members in members.items():
+            _append_members(segment, segment_starts[segment], segment_members)
+
+        # Delete exactly the rows that were written, in chunks to stay under the
+        # database's bound parameter limit. A session cleared concurrently has
+        # fewer rows left than were read, so it is not indexed and its new
+        # member is zeroed instead of bringing the messages back.
+        discarded = []
+        for session_id, session_rows, segment, offset, length in planned:
+            ids = [row.id for row in session_rows]
+            deleted = 0
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                deleted += db.query(DBConversation).filter(
+                    DBConversation.id.in_(ids[start:start + DELETE_CHUNK_SIZE])
+                ).delete(synchronize_session=False)
+
+            if deleted < len(ids):
+                discarded.append((segment, offset, length))
+                continue
+
+            db.add(DBArchivedSession(
+                session_id=session_id,
+                segment=segment,
+                offset=offset,
+                length=length,
+                message_count=len(session_rows),
+                last_message_at=last_activity[session_id],
+                archived_at=datetime.now()
+            ))
+            archived += 1
+
+        db.commit()
+        db.expunge_all()
+        scrub_archived_members(discarded)
+        _clear_journal()
+
+
+def expire_archived_sessions(db: Session, retention_days: int, batch_size: int) -> int:
+    """Delete archived sessions and segments past retention. Returns index rows removed."""
+    # Whole days only, so a segment is dropped together with all of its index rows
+    cutoff_day = date.today() - timedelta(days=retention_days)
+    cutoff = datetime.combine(cutoff_day, time.min)
+    removed = 0
+
+    while True:
+        ids = [row.id for row in db.query(DBArchivedSession.id).filter(
+            DBArchivedSession.last_message_at < cutoff
+        ).limit(batch_size)]
+        if not ids:
+            break
+        db.query(DBArchivedSession).filter(
+            DBArchivedSession.id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.commit()
+        removed += len(ids)
+
+    if os.path.isdir(settings.archive_dir):
+        for name in os.listdir(settings.archive_dir):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                if _segment_day(name) < cutoff_day:
+                    os.remove(os.path.join(settings.archive_dir, name))
+
+    return removed
+
+
+def load_archived_sessions(db: Session, session_ids: List[str]) -> Dict[str, List[Dict]]:
+    """Read the archived messages of several sessions, oldest first per session."""
+    entries = db.query(DBArchivedSession).filter(
+        DBArchivedSession.session_id.in_(session_ids)
+    ).order_by(DBArchivedSession.archived_at, DBArchivedSession.id).all()
+
+    messages: Dict[str, List[Dict]] = {}
+    for entry in entries:
+        with open(os.path.join(settings.archive_dir, entry.segment), "rb") as f:
+            f.seek(entry.offset)
+            payload = gzip.decompress(f.read(entry.length))
+        messages.setdefault(entry.session_id, []).extend(
+            json.loads(line) for line in payload.decode("utf-8").splitlines()
+        )
+    return messages
+
+
+def load_archived_messages(db: Session, session_id: str) -> List[Dict]:
+    """Read a session's archived messages, oldest first."""
+    return load_archived_sessions(db, [session_id]).get(session_id, [])
+
+
+def delete_archived_session(db: Session, session_id: str) -> List[Tuple[str, int, int]]:
+    """Drop a session from the archive index and return its (segment, offset, length) spans.
+
+    Pass the spans to `scrub_archived_members` once the deletion is committed
+    to erase the archived text itself.
+    """
+    entries = db.query(DBArchivedSession).filter(
+        DBArchivedSession.session_id == session_id
+    ).all()
+    spans = [(entry.segment, entry.offset, entry.length) for entry in entries]
+
+    db.query(DBArchivedSession).filter(
+        DBArchivedSession.session_id == session_id
+    ).delete(synchronize_session=False)
+    return spans
+
+
+def scrub_archived_members(spans: List[Tuple[str, int, int]]):
+    """Overwrite archived gzip members with zeros so their content is gone.
+
+    Members are only ever read through the index, so zeroing one in place
+    leaves the rest of the segment readable without rewriting it.
+    """
+    for segment, offset, length in spans:
+        try:
+            with open(os.path.join(settings.archive_dir, segment), "r+b") as f:
+                # A crash may have cut the member short; never extend the file
+                length = min(length, os.fstat(f.fileno()).st_size - offset)
+                if length <= 0:
+                    continue
+                f.seek(offset)
+                f.write(bytes(length))
+                f.flush()
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            continue  # Segment already expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive idle conversations and expire old archives.")
+    parser.add_argument("--idle-days", type=int, default=settings.archive_idle_days)
+    parser.add_argument("--retention-days", type=int, default=settings.archive_retention_days)
+    parser.add_argument("--batch-size", type=int, default=settings.archive_batch_size)
+    parser.add_argument("--dry-run", action="store_true", help="Report idle sessions without moving them")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.dry_run:
+            cutoff = datetime.now() - timedelta(days=args.idle_days)
+            idle = find_idle_sessions(db, cutoff, limit=None)
+            print(f"🗄️ {len(idle)} sessions idle for more than {args.idle_days} days")
+            return
+
+        archived = archive_idle_sessions(db, args.idle_days, args.batch_size)
+        print(f"🗄️ Archived {archived} sessions")
+        expired = expire_archived_sessions(db, args.retention_days, args.batch_size)
+        print(f"🧹 Expired {expired} archived sessions")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
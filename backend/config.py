@@ -16,6 +16,16 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     
+    # Image Upload Configuration
+    max_image_upload_bytes: int = 10 * 1024 * 1024
+    image_spool_memory_bytes: int = 1024 * 1024
+    
+    # Conversation Archive Configuration
+    archive_dir: str = "./archive"
+    archive_idle_days: int = 30  # Sessions idle this long leave the hot table
+    archive_retention_days: int = 365  # Archived sessions older than this are deleted
+    archive_batch_size: int = 500
+    
     # CORS Configuration
     cors_origins: str = "http://localhost:*,http://127.0.0.1:*"
     
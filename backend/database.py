@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine, Column, String, Float, DateTime, Text, JSON
+from sqlalchemy import create_engine, Column, String, Float, Integer, BigInteger, DateTime, Text, JSON
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from datetime import datetime
+from typing import Dict, Optional
 from config import settings
 
 # Create database engine
@@ -44,6 +45,20 @@ class DBConversation(Base):
     timestamp = Column(DateTime, default=datetime.now)
 
 
+class DBArchivedSession(Base):
+    """Lookup index for conversations moved to compressed archive segments."""
+    __tablename__ = "archived_sessions"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String, index=True)
+    segment = Column(String)  # File name inside settings.archive_dir
+    offset = Column(BigInteger)  # Byte offset of the session's gzip member
+    length = Column(Integer)
+    message_count = Column(Integer)
+    last_message_at = Column(DateTime, index=True)
+    archived_at = Column(DateTime, default=datetime.now)
+
+
 class DBOrder(Base):
     """Order database model."""
     __tablename__ = "orders"
@@ -83,3 +98,18 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def load_user_preferences(db: Session, user_id: str) -> Optional[Dict]:
+    """Load a user's preferences as the dict passed to FoodAIService."""
+    user = db.query(DBUser).filter(DBUser.user_id == user_id).first()
+    if not user:
+        return None
+    
+    return {
+        "dietary_restrictions": user.dietary_restrictions or [],
+        "favorite_cuisines": user.favorite_cuisines or [],
+        "allergies": user.allergies or [],
+        "spice_level": user.spice_level,
+        "budget_range": user.budget_range
+    }
@@ -1,8 +1,6 @@
 import google.generativeai as genai
-from typing import Dict, Optional, List
+from typing import Any, BinaryIO, Callable, Dict, Optional, List
 from config import settings
-import base64
-from io import BytesIO
 from PIL import Image
 
 # Configure Google AI
@@ -12,8 +10,15 @@ genai.configure(api_key=settings.google_api_key)
 class FoodAIService:
     """Service for FoodAI Assistant using Google Gemini API."""
     
-    def __init__(self):
-        """Initialize the FoodAI service."""
+    def __init__(self, model_factory: Optional[Callable[[], Any]] = None):
+        """Initialize the FoodAI service.
+        
+        `model_factory` builds the object used for generation; it defaults to
+        `genai.GenerativeModel(settings.gemini_model)` and can be swapped for
+        another model name or an offline fake (see replay.py).
+        """
+        self.model_factory = model_factory or (lambda: genai.GenerativeModel(settings.gemini_model))
+        
         # Store conversation histories by session_id
         self.chat_histories: Dict[str, List[Dict[str, str]]] = {}
         
@@ -75,8 +80,7 @@ Quando o usuário enviar uma imagem de comida:
         full_prompt = "\n\n".join(conversation_parts)
         
         # Generate response using Gemini
-        model = genai.GenerativeModel(settings.gemini_model)
-        response = model.generate_content(full_prompt)
+        response = await self._generate(full_prompt)
         
         # Add to history
         history.append({"role": "user", "content": message})
@@ -88,14 +92,16 @@ Quando o usuário enviar uma imagem de comida:
         self,
         session_id: str,
         message: str,
-        image_data: str,
+        image_file: BinaryIO,
         user_preferences: Optional[Dict] = None
     ) -> str:
-        """Process a message with an image using Gemini's multimodal capabilities."""
+        """Process a message with an image using Gemini's multimodal capabilities.
+        
+        `image_file` is read in place (e.g. a spooled upload), so the caller
+        must keep it open until this coroutine returns.
+        """
         try:
-            # Decode base64 image
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(BytesIO(image_bytes))
+            image = Image.open(image_file)
             
             # Build prompt with preferences context
             prompt = f"""{self.system_prompt}
@@ -114,8 +120,7 @@ Por favor:
                 prompt = f"{prompt}\n\n{context}"
             
             # Use Gemini's native multimodal API
-            model = genai.GenerativeModel(settings.gemini_model)
-            response = model.generate_content([prompt, image])
+            response = await self._generate([prompt, image])
             
             # Add to conversation history
             history = self.get_or_create_history(session_id)
@@ -127,6 +132,11 @@ Por favor:
         except Exception as e:
             return f"Desculpe, tive um problema ao analisar a imagem. Erro: {str(e)}"
     
+    async def _generate(self, contents: Any) -> Any:
+        """Generate content without blocking the event loop."""
+        model = self.model_factory()
+        return await model.generate_content_async(contents)
+    
     def _build_preferences_context(self, preferences: Dict) -> str:
         """Build context string from user preferences."""
         context_parts = ["Preferências do usuário:"]
@@ -0,0 +1,353 @@
+"""Offline batch replay of stored conversations through FoodAIService.
+
+Pages sessions out of the conversations table and the compressed archive
+(see archive.py), replays every user turn against the current prompt/model
+and appends one JSON line per turn with the new response, the original
+response, latency and token counts.
+
+Usage:
+    python replay.py --output replay.jsonl --concurrency 16
+    python replay.py --output replay.jsonl --model models/gemini-1.5-pro
+    python replay.py --output replay.jsonl --fake-model   # no API calls
+
+Re-running with the same --output resumes: sessions already written are
+skipped. A run interrupted mid-write may leave a partial session behind,
+so consumers should de-duplicate on (session_id, turn).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import google.generativeai as genai
+
+from sqlalchemy import select, union
+from sqlalchemy.exc import OperationalError
+
+from config import settings
+from archive import load_archived_sessions
+from database import SessionLocal, DBArchivedSession, DBConversation, load_user_preferences
+from langchain_service import FoodAIService
+from models import MessageRole, MessageType
+
+FETCH_RETRIES = 5
+
+# Token usage of the turn currently being replayed (one dict per task)
+_turn_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("turn_usage", default=None)
+
+
+class FakeModel:
+    """Offline stand-in for genai.GenerativeModel used for dry runs."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    async def generate_content_async(self, contents: Any) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        prompt = contents if isinstance(contents, str) else str(contents[0])
+        text = f"[fake] {prompt[-80:]}"
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=len(prompt.split()),
+                candidates_token_count=len(text.split())
+            )
+        )
+
+
+class ReplayService(FoodAIService):
+    """FoodAIService that records token usage for the current turn."""
+
+    async def _generate(self, contents: Any) -> Any:
+        response = await super()._generate(contents)
+        usage = _turn_usage.get()
+        metadata = getattr(response, "usage_metadata", None)
+        if usage is not None and metadata is not None:
+            usage["prompt_tokens"] = metadata.prompt_token_count
+            usage["output_tokens"] = metadata.candidates_token_count
+        return response
+
+
+def fetch_session_batch(after: Optional[str], batch_size: int) -> List[Tuple[str, List[Any], Optional[Dict]]]:
+    """Load the next `batch_size` sessions after `after`, with their users' preferences.
+
+    Each batch uses its own short-lived database session, so no read
+    transaction (and, on SQLite, no read lock) is held while turns replay.
+    """
+    db = SessionLocal()
+    try:
+        # Sessions idle past ARCHIVE_IDLE_DAYS live (partly) in the archive
+        hot_ids = select(DBConversation.session_id)
+        archived_ids = select(DBArchivedSession.session_id)
+        if after is not None:
+            hot_ids = hot_ids.where(DBConversation.session_id > after)
+            archived_ids = archived_ids.where(DBArchivedSession.session_id > after)
+        candidates = union(hot_ids, archived_ids).subquery()
+        session_ids = list(db.execute(
+            select(candidates.c.session_id).order_by(candidates.c.session_id).limit(batch_size)
+        ).scalars())
+        if not session_ids:
+            return []
+
+        hot_rows = db.query(
+            DBConversation.session_id,
+            DBConversation.user_id,
+            DBConversation.role,
+            DBConversation.content,
+            DBConversation.message_type
+        ).filter(
+            DBConversation.session_id.in_(session_ids)
+        ).order_by(DBConversation.session_id, DBConversation.timestamp).all()
+
+        # Archived messages come first, then any newer hot tail
+        sessions = {
+            session_id: [SimpleNamespace(**message) for message in messages]
+            for session_id, messages in load_archived_sessions(db, session_ids).items()
+        }
+        for session_id, group in itertools.groupby(hot_rows, key=lambda row: row.session_id):
+            sessions.setdefault(session_id, []).extend(group)
+
+        preferences: Dict[str, Optional[Dict]] = {}
+        batch = []
+        for session_id in session_ids:
+            # Empty when cleared between the queries above; it replays no turns
+            session_rows = sessions.get(session_id, [])
+            user_id = session_rows[0].user_id if session_rows else None
+            if user_id is not None and user_id not in preferences:
+                preferences[user_id] = load_user_preferences(db, user_id)
+            batch.append((session_id, session_rows, preferences.get(user_id)))
+        return batch
+    finally:
+        db.close()
+
+
+def _fetch_with_retry(after: Optional[str], batch_size: int) -> List[Tuple[str, List[Any], Optional[Dict]]]:
+    """Fetch a batch, backing off while the database is busy (e.g. SQLite locked)."""
+    for attempt in range(FETCH_RETRIES):
+        try:
+            return fetch_session_batch(after, batch_size)
+        except OperationalError as e:
+            if attempt == FETCH_RETRIES - 1:
+                raise
+            delay = 2 ** attempt
+            print(f"⚠️ Fetch failed ({e.orig}), retrying in {delay}s")
+            time.sleep(delay)
+
+
+def iter_pending_sessions(
+    batch_size: int,
+    completed: Set[str],
+    limit: int
+) -> Iterator[Tuple[str, List[Any], Optional[Dict]]]:
+    """Yield sessions still to replay, with the preferences the live API would use.
+
+    Sessions are paged by `session_id`. `limit` counts only sessions that are
+    actually yielded, so a resumed run with the same --limit still makes progress.
+    """
+    scheduled = 0
+    after = None
+    while True:
+        batch = _fetch_with_retry(after, batch_size)
+        if not batch:
+            return
+        after = batch[-1][0]
+
+        for session_id, rows, user_preferences in batch:
+            if session_id in completed:
+                continue
+            if limit and scheduled >= limit:
+                return
+            scheduled += 1
+            yield session_id, rows, user_preferences
+
+
+def pair_turns(rows: List[Any]) -> List[Tuple[str, str, Optional[str]]]:
+    """Pair each user message with the assistant reply that followed it."""
+    turns = []
+    for row in rows:
+        if row.role == MessageRole.USER.value:
+            turns.append([row.content, row.message_type, None])
+        elif row.role == MessageRole.ASSISTANT.value and turns and turns[-1][2] is None:
+            turns[-1][2] = row.content
+    return [tuple(turn) for turn in turns]
+
+
+def load_completed_sessions(path: str) -> Set[str]:
+    """Collect sessions whose last turn is already in the output file."""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Truncated line from an interrupted run
+            if record["turn"] == record["turns"] - 1:
+                completed.add(record["session_id"])
+    return completed
+
+
+def _has_truncated_line(path: str) -> bool:
+    """Check whether an interrupted run left the file without a final newline."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+async def replay_session(
+    service: ReplayService,
+    session_id: str,
+    rows: List[Any],
+    user_preferences: Optional[Dict] = None
+) -> List[Dict]:
+    """Replay one session turn by turn and return its output records."""
+    turns = pair_turns(rows)
+    history = service.get_or_create_history(session_id)
+    records = []
+
+    try:
+        for index, (message, message_type, original) in enumerate(turns):
+            record = {
+                "session_id": session_id,
+                "turn": index,
+                "turns": len(turns),
+                "message_type": message_type,
+                "message": message,
+                "original_response": original
+            }
+
+            if message_type != MessageType.TEXT.value:
+                # Image bytes are not persisted, so keep the original exchange as context
+                history.append({"role": "user", "content": f"[Imagem enviada] {message}"})
+                history.append({"role": "assistant", "content": original or ""})
+                record["skipped"] = "image_not_stored"
+                records.append(record)
+                continue
+
+            usage: Dict[str, int] = {}
+            _turn_usage.set(usage)
+            start = time.perf_counter()
+            try:
+                record["response"] = await service.process_text_message(
+                    session_id=session_id,
+                    message=message,
+                    user_preferences=user_preferences
+                )
+            except Exception as e:
+                record["error"] = str(e)
+            record["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            record.update(usage)
+            records.append(record)
+    finally:
+        service.clear_memory(session_id)
+
+    return records
+
+
+async def run_replay(args: argparse.Namespace) -> None:
+    """Replay all stored sessions, appending results to args.output."""
+    completed = load_completed_sessions(args.output)
+
+    if args.fake_model:
+        model_factory = lambda: FakeModel(latency=args.fake_latency)
+    else:
+        model_factory = lambda: genai.GenerativeModel(args.model)
+
+    service = ReplayService(model_factory=model_factory)
+    if args.system_prompt_file:
+        with open(args.system_prompt_file, encoding="utf-8") as f:
+            service.system_prompt = f.read()
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    tasks: Set[asyncio.Task] = set()
+    stats = {"sessions": 0, "turns": 0, "errors": 0}
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        if _has_truncated_line(args.output):
+            out.write("\n")
+
+        async def worker(session_id: str, rows: List[Any], user_preferences: Optional[Dict]) -> None:
+            try:
+                records = await replay_session(service, session_id, rows, user_preferences)
+                if records:
+                    out.write("".join(
+                        json.dumps(record, ensure_ascii=False) + "\n" for record in records
+                    ))
+                    out.flush()
+                stats["sessions"] += 1
+                stats["turns"] += len(records)
+                stats["errors"] += sum(1 for record in records if "error" in record)
+                if stats["sessions"] % args.progress_every == 0:
+                    print(f"🔁 {stats['sessions']} sessions, {stats['turns']} turns, {stats['errors']} errors")
+            finally:
+                semaphore.release()
+
+        # Database fetches run on their own thread so in-flight turns keep going
+        # while the next batch is read.
+        loop = asyncio.get_running_loop()
+        sessions = iter_pending_sessions(args.batch_size, completed, args.limit)
+        fetch_error = None
+        with ThreadPoolExecutor(max_workers=1) as fetcher:
+            try:
+                while True:
+                    await semaphore.acquire()
+                    try:
+                        pending = await loop.run_in_executor(fetcher, next, sessions, None)
+                    except Exception as e:
+                        semaphore.release()
+                        fetch_error = e
+                        break
+                    if pending is None:
+                        semaphore.release()
+                        break
+                    task = asyncio.create_task(worker(*pending))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            finally:
+                await loop.run_in_executor(fetcher, sessions.close)
+
+        # Let in-flight sessions finish so their results are kept for resuming
+        await asyncio.gather(*tasks)
+
+    if fetch_error is not None:
+        print(f"⚠️ Stopped early, could not read conversations: {fetch_error}")
+        print(f"   {stats['sessions']} sessions saved; re-run with the same --output to resume")
+        raise SystemExit(1)
+
+    print(f"✅ Replay finished: {stats['sessions']} sessions, {stats['turns']} turns, {stats['errors']} errors")
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay stored conversations through FoodAIService.")
+    parser.add_argument("--output", required=True, help="JSONL file to append results to")
+    parser.add_argument("--model", default=settings.gemini_model, help="Gemini model to replay against")
+    parser.add_argument("--system-prompt-file", help="Replace the system prompt with this file's contents")
+    parser.add_argument("--concurrency", type=_positive_int, default=8, help="Sessions replayed in parallel")
+    parser.add_argument("--batch-size", type=_positive_int, default=200, help="Sessions fetched per database transaction")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many sessions (0 = all)")
+    parser.add_argument("--fake-model", action="store_true", help="Use an offline fake model instead of Gemini")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="Seconds the fake model sleeps per call")
+    parser.add_argument("--progress-every", type=_positive_int, default=1000, help="Print progress every N sessions")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_replay(parse_args()))
@@ -1,65 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from typing import List
+from typing import BinaryIO, List, Optional
+import base64
+import binascii
 import uuid
 from datetime import datetime
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
 
 from models import ChatRequest, ChatResponse, ChatMessage, MessageRole, MessageType
-from database import get_db, DBConversation, DBUser
+from config import settings
+from database import get_db, load_user_preferences, DBArchivedSession, DBConversation
+from archive import load_archived_messages, delete_archived_session, scrub_archived_members
 from langchain_service import food_ai_service
+from serialization import json_response, make_etag
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 
-@router.post("/message", response_model=ChatResponse)
-async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
-    """Send a text or image message to the AI assistant."""
+async def _process_message(
+    db: Session,
+    session_id: str,
+    user_id: str,
+    message: str,
+    image_file: Optional[BinaryIO] = None
+) -> ChatResponse:
+    """Run a chat turn through the AI service and persist both sides of it."""
     try:
         # Get user preferences
-        user = db.query(DBUser).filter(DBUser.user_id == request.user_id).first()
-        user_preferences = None
-        
-        if user:
-            user_preferences = {
-                "dietary_restrictions": user.dietary_restrictions or [],
-                "favorite_cuisines": user.favorite_cuisines or [],
-                "allergies": user.allergies or [],
-                "spice_level": user.spice_level,
-                "budget_range": user.budget_range
-            }
+        user_preferences = load_user_preferences(db, user_id)
         
         # Save user message to database
         user_message = DBConversation(
             id=str(uuid.uuid4()),
-            session_id=request.session_id,
-            user_id=request.user_id,
+            session_id=session_id,
+            user_id=user_id,
             role=MessageRole.USER.value,
-            content=request.message,
-            message_type=MessageType.TEXT_WITH_IMAGE.value if request.image_data else MessageType.TEXT.value,
+            content=message,
+            message_type=MessageType.TEXT_WITH_IMAGE.value if image_file is not None else MessageType.TEXT.value,
             timestamp=datetime.now()
         )
         db.add(user_message)
         
         # Process message with AI
-        if request.image_data:
+        if image_file is not None:
             ai_response = await food_ai_service.process_image_message(
-                session_id=request.session_id,
-                message=request.message,
-                image_data=request.image_data,
+                session_id=session_id,
+                message=message,
+                image_file=image_file,
                 user_preferences=user_preferences
             )
         else:
             ai_response = await food_ai_service.process_text_message(
-                session_id=request.session_id,
-                message=request.message,
+                session_id=session_id,
+                message=message,
                 user_preferences=user_preferences
             )
         
         # Save AI response to database
         ai_message = DBConversation(
             id=str(uuid.uuid4()),
-            session_id=request.session_id,
-            user_id=request.user_id,
+            session_id=session_id,
+            user_id=user_id,
             role=MessageRole.ASSISTANT.value,
             content=ai_response,
             message_type=MessageType.TEXT.value,
@@ -69,7 +73,7 @@ async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
         db.commit()
         
         return ChatResponse(
-            session_id=request.session_id,
+            session_id=session_id,
             message=ai_response,
             timestamp=datetime.now()
         )
@@ -79,26 +83,134 @@ async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
 
+async def _spool_request_body(request: Request) -> SpooledTemporaryFile:
+    """Stream the request body into a spooled temp file, enforcing the upload limit."""
+    max_bytes = settings.max_image_upload_bytes
+    
+    # Reject early when the client announces an oversized body
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {max_bytes} bytes")
+    
+    spool = SpooledTemporaryFile(max_size=settings.image_spool_memory_bytes)
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Image exceeds {max_bytes} bytes")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    
+    if size == 0:
+        spool.close()
+        raise HTTPException(status_code=400, detail="Empty image body")
+    
+    spool.seek(0)
+    return spool
+
+
+@router.post("/message", response_model=ChatResponse)
+async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
+    """Send a text or image message to the AI assistant."""
+    image_file = None
+    if request.image_data:
+        try:
+            image_file = BytesIO(base64.b64decode(request.image_data, validate=True))
+        except binascii.Error:
+            raise HTTPException(status_code=400, detail="Invalid base64 image_data")
+    
+    return await _process_message(
+        db,
+        session_id=request.session_id,
+        user_id=request.user_id,
+        message=request.message,
+        image_file=image_file
+    )
+
+
+@router.post("/message/image", response_model=ChatResponse)
+async def send_image_message(
+    request: Request,
+    session_id: str,
+    user_id: str,
+    message: str = "",
+    db: Session = Depends(get_db)
+):
+    """Send an image as the raw request body (e.g. image/jpeg) to the AI assistant.
+    
+    The body is streamed to a spooled temp file instead of being base64 encoded
+    inside JSON, so large photos never sit in memory as multiple copies.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.lower().startswith("image/"):
+        raise HTTPException(status_code=415, detail="Request body must be an image (Content-Type: image/*)")
+    
+    image_file = await _spool_request_body(request)
+    try:
+        # Reject bodies Pillow cannot identify before anything is stored
+        try:
+            Image.open(image_file)
+        except (UnidentifiedImageError, OSError):
+            raise HTTPException(status_code=400, detail="Request body is not a readable image")
+        image_file.seek(0)
+        
+        return await _process_message(
+            db,
+            session_id=session_id,
+            user_id=user_id,
+            message=message,
+            image_file=image_file
+        )
+    finally:
+        image_file.close()
+
+
 @router.get("/history/{session_id}", response_model=List[ChatMessage])
-async def get_conversation_history(session_id: str, db: Session = Depends(get_db)):
+async def get_conversation_history(session_id: str, request: Request, db: Session = Depends(get_db)):
     """Get conversation history for a session."""
     try:
-        conversations = db.query(DBConversation).filter(
-            DBConversation.session_id == session_id
-        ).order_by(DBConversation.timestamp).all()
+        # Messages are append-only, so counts and latest markers version the history
+        hot_count, last_timestamp = db.query(
+            func.count(DBConversation.id), func.max(DBConversation.timestamp)
+        ).filter(DBConversation.session_id == session_id).one()
+        archived_count, last_archived_id = db.query(
+            func.count(DBArchivedSession.id), func.max(DBArchivedSession.id)
+        ).filter(DBArchivedSession.session_id == session_id).one()
+        etag = make_etag("history", session_id, hot_count, last_timestamp, archived_count, last_archived_id)
         
-        messages = [
-            ChatMessage(
-                role=MessageRole(conv.role),
-                content=conv.content,
-                message_type=MessageType(conv.message_type),
-                image_url=conv.image_url,
-                timestamp=conv.timestamp
-            )
-            for conv in conversations
-        ]
+        def build():
+            # Sessions idle long enough live (partly) in the compressed archive
+            messages = [
+                {
+                    "role": archived["role"],
+                    "content": archived["content"],
+                    "message_type": archived["message_type"],
+                    "image_url": archived["image_url"],
+                    "timestamp": archived["timestamp"]
+                }
+                for archived in load_archived_messages(db, session_id)
+            ]
+            
+            conversations = db.query(DBConversation).filter(
+                DBConversation.session_id == session_id
+            ).order_by(DBConversation.timestamp).all()
+            
+            messages += [
+                {
+                    "role": conv.role,
+                    "content": conv.content,
+                    "message_type": conv.message_type,
+                    "image_url": conv.image_url,
+                    "timestamp": conv.timestamp
+                }
+                for conv in conversations
+            ]
+            return messages
         
-        return messages
+        return json_response(request, etag, build)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving history: {str(e)}")
@@ -112,7 +224,9 @@ async def clear_conversation_history(session_id: str, db: Session = Depends(get_
         db.query(DBConversation).filter(
             DBConversation.session_id == session_id
         ).delete()
+        archived_spans = delete_archived_session(db, session_id)
         db.commit()
+        scrub_archived_members(archived_spans)
         
         # Clear from memory
         food_ai_service.clear_memory(session_id)
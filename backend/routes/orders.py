@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List
 import uuid
@@ -6,6 +7,7 @@ from datetime import datetime
 
 from models import Order, OrderRequest, OrderResponse, OrderStatus
 from database import get_db, DBOrder
+from serialization import json_response, make_etag
 
 router = APIRouter(prefix="/api/orders", tags=["orders"])
 
@@ -52,45 +54,48 @@ async def create_order(request: OrderRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error creating order: {str(e)}")
 
 
+def _order_to_dict(order: DBOrder) -> dict:
+    """Encode an order row for the JSON response."""
+    return {
+        "id": order.id,
+        "user_id": order.user_id,
+        "items": order.items,
+        "total_price": order.total_price,
+        "status": order.status,
+        "created_at": order.created_at,
+        "updated_at": order.updated_at
+    }
+
+
 @router.get("/user/{user_id}", response_model=List[Order])
-async def get_user_orders(user_id: str, db: Session = Depends(get_db)):
+async def get_user_orders(user_id: str, request: Request, db: Session = Depends(get_db)):
     """Get all orders for a user."""
     try:
-        orders = db.query(DBOrder).filter(
-            DBOrder.user_id == user_id
-        ).order_by(DBOrder.created_at.desc()).all()
+        # updated_at is bumped on every change, so it versions the whole list
+        order_count, last_updated_at = db.query(
+            func.count(DBOrder.id), func.max(DBOrder.updated_at)
+        ).filter(DBOrder.user_id == user_id).one()
+        etag = make_etag("orders", user_id, order_count, last_updated_at)
+        
+        def build():
+            orders = db.query(DBOrder).filter(
+                DBOrder.user_id == user_id
+            ).order_by(DBOrder.created_at.desc()).all()
+            return [_order_to_dict(order) for order in orders]
         
-        return [
-            Order(
-                id=order.id,
-                user_id=order.user_id,
-                items=order.items,
-                total_price=order.total_price,
-                status=OrderStatus(order.status),
-                created_at=order.created_at,
-                updated_at=order.updated_at
-            )
-            for order in orders
-        ]
+        return json_response(request, etag, build)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving orders: {str(e)}")
 
 
 @router.get("/{order_id}", response_model=Order)
-async def get_order(order_id: str, db: Session = Depends(get_db)):
+async def get_order(order_id: str, request: Request, db: Session = Depends(get_db)):
     """Get a specific order by ID."""
     order = db.query(DBOrder).filter(DBOrder.id == order_id).first()
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    return Order(
-        id=order.id,
-        user_id=order.user_id,
-        items=order.items,
-        total_price=order.total_price,
-        status=OrderStatus(order.status),
-        created_at=order.created_at,
-        updated_at=order.updated_at
-    )
+    etag = make_etag("order", order.id, order.updated_at)
+    return json_response(request, etag, lambda: _order_to_dict(order))
@@ -1,14 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
 from models import UserPreferences
 from database import get_db, DBUser
+from serialization import json_response, make_etag
 
 router = APIRouter(prefix="/api/preferences", tags=["preferences"])
 
 
 @router.get("/{user_id}", response_model=UserPreferences)
-async def get_user_preferences(user_id: str, db: Session = Depends(get_db)):
+async def get_user_preferences(user_id: str, request: Request, db: Session = Depends(get_db)):
     """Get user preferences."""
     user = db.query(DBUser).filter(DBUser.user_id == user_id).first()
     
@@ -24,14 +25,18 @@ async def get_user_preferences(user_id: str, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(user)
     
-    return UserPreferences(
-        user_id=user.user_id,
-        dietary_restrictions=user.dietary_restrictions or [],
-        favorite_cuisines=user.favorite_cuisines or [],
-        allergies=user.allergies or [],
-        spice_level=user.spice_level,
-        budget_range=user.budget_range
-    )
+    preferences = {
+        "user_id": user.user_id,
+        "dietary_restrictions": user.dietary_restrictions or [],
+        "favorite_cuisines": user.favorite_cuisines or [],
+        "allergies": user.allergies or [],
+        "spice_level": user.spice_level,
+        "budget_range": user.budget_range
+    }
+    
+    # users has no updated_at column, so the (small) row itself is the version
+    etag = make_etag("preferences", *preferences.values())
+    return json_response(request, etag, lambda: preferences)
 
 
 @router.put("/{user_id}", response_model=UserPreferences)
@@ -0,0 +1,109 @@
+"""Fast JSON responses with strong ETags for read endpoints.
+
+Read routes build plain dicts straight from ORM rows and encode them with
+orjson, returning a `Response` so FastAPI skips `response_model`
+re-validation. The ETag is derived from cheap row version markers (counts,
+`updated_at`, timestamps) so an unchanged resource usually answers `304` before
+any row is loaded or serialized.
+"""
+import gzip
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable
+
+import orjson
+from fastapi import Request, Response
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+GZIP_SUFFIX = "-gzip"
+COMPRESSIBLE_CACHE_SIZE = 10000
+
+# ETag -> whether its payload reaches GZIP_MIN_BYTES (bounded, most recent last)
+_compressible: "OrderedDict[str, bool]" = OrderedDict()
+
+
+def make_etag(*parts: Any) -> str:
+    """Build a strong ETag from row version markers."""
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode("utf-8"), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Check If-None-Match against the representation's `etag`."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _remember_compressible(etag: str, compressible: bool):
+    _compressible[etag] = compressible
+    _compressible.move_to_end(etag)
+    if len(_compressible) > COMPRESSIBLE_CACHE_SIZE:
+        _compressible.popitem(last=False)
+
+
+def _accepts_gzip(request: Request) -> bool:
+    """Check Accept-Encoding for gzip with a non-zero q-value (or an accepted `*`)."""
+    qualities = {}
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def json_response(request: Request, etag: str, build: Callable[[], Any]) -> Response:
+    """Encode `build()` with orjson unless the client already holds this representation.
+
+    A 304 carries the same ETag the 200 would have, so the gzip variant is
+    revalidated with its own tag. Whether a payload is large enough to be
+    compressed is remembered per ETag; only when that is unknown does a
+    conditional request have to encode the body to decide.
+    """
+    use_gzip = _accepts_gzip(request)
+    body = None
+    
+    if request.headers.get("if-none-match"):
+        compressible = _compressible.get(etag) if use_gzip else False
+        if compressible is None:
+            body = orjson.dumps(build())
+            compressible = len(body) >= GZIP_MIN_BYTES
+            _remember_compressible(etag, compressible)
+        representation = f'{etag[:-1]}{GZIP_SUFFIX}"' if compressible else etag
+        if _etag_matches(request, representation):
+            return Response(status_code=304, headers={"ETag": representation, "Vary": "Accept-Encoding"})
+    
+    if body is None:
+        body = orjson.dumps(build())
+        _remember_compressible(etag, len(body) >= GZIP_MIN_BYTES)
+    
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if use_gzip and len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        # Each encoding is a distinct representation, so it gets its own strong ETag
+        headers["ETag"] = f'{etag[:-1]}{GZIP_SUFFIX}"'
+        headers["Content-Encoding"] = "gzip"
+    
+    return Response(content=body, media_type="application/json", headers=headers)